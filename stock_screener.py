@@ -1,9 +1,29 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import streamlit as st
 import yfinance as yf
 import pandas as pd
 import numpy as np
+import bottleneck as bn
+import pyarrow as pa
+import pyarrow.parquet as pq
 import plotly.graph_objects as go
 
+# Downloaded bars are cached on disk so repeated scans skip the network
+CACHE_DIR = Path(".cache/bars")
+CACHE_TTL = 4 * 60 * 60  # seconds
+PERIOD = "6mo"
+INTERVAL = "1d"
+# Fixed columnar schema for cached and freshly downloaded bars alike
+BAR_DTYPES = {"Open": "float32", "High": "float32", "Low": "float32", "Close": "float32", "Volume": "int64"}
+
+SCAN_CHUNK = 50  # tickers screened between partial-result updates
+
+RESULT_COLUMNS = ["1M Gain %", "3M Gain %", "6M Gain %", "Avg Volume", "ADR %", "Consolidation"]
+RESULT_DECIMALS = {"1M Gain %": 1, "3M Gain %": 1, "6M Gain %": 1, "ADR %": 2, "Consolidation": 3}
+
 st.set_page_config(page_title="US Stock Screener v1.1", layout="wide")
 st.title("📊 US Stock Screener v1.1 (Safe & Faster)")
 
@@ -20,96 +40,222 @@ tickers_input = st.text_area(
 )
 
 # --- Helper Functions ---
-def adr_percent(df):
-    return ((df["High"] - df["Low"]) / df["Close"]) * 100
+def adr_percent(high, low, close):
+    out = np.subtract(high, low)  # one buffer, updated in place
+    out /= close
+    out *= 100
+    return out
 
-def consolidation_score(df, lookback=10):
-    recent = df.tail(lookback)
-    return (recent["High"].max() - recent["Low"].min()) / recent["Close"].mean()
+def consolidation_score(high, low, close, lookback=10):
+    return (high[-lookback:].max(axis=0) - low[-lookback:].min(axis=0)) / close[-lookback:].mean(axis=0)
 
-def fetch_data(ticker):
+def add_indicators(df):
+    if len(df) < 20:
+        return pd.DataFrame()
+    close = df["Close"].to_numpy()
+    # Attach all derived columns in one go rather than one insert each
+    return df.assign(**{
+        "10SMA": bn.move_mean(close, 10),
+        "20SMA": bn.move_mean(close, 20),
+        "ADR%": adr_percent(df["High"].to_numpy(), df["Low"].to_numpy(), close),
+    })
+
+def read_cache(ticker):
+    path = CACHE_DIR / f"{ticker}_{PERIOD}_{INTERVAL}.parquet"
     try:
-        df = yf.download(ticker, period="6mo", interval="1d", progress=False)
-        df.dropna(inplace=True)
-        if len(df) < 20:
-            return pd.DataFrame()
-        df["10SMA"] = df["Close"].rolling(10).mean()
-        df["20SMA"] = df["Close"].rolling(20).mean()
-        df["ADR%"] = adr_percent(df)
+        if time.time() - path.stat().st_mtime < CACHE_TTL:
+            return pq.read_table(path).to_pandas(split_blocks=True, self_destruct=True)
+    except Exception:
+        pass
+    return None
+
+def clean_bars(df):
+    if df.empty:
         return df
+    if list(df.columns) != list(BAR_DTYPES):
+        df = df[list(BAR_DTYPES)]
+    # Daily bars are rarely missing anything, so only filter rows when needed;
+    # every price feeds the screen or the candles, and Volume is cast to int64
+    valid = ~np.isnan(df["Close"].to_numpy())
+    for col in ("Open", "High", "Low", "Volume"):
+        valid &= ~np.isnan(df[col].to_numpy())
+    if not valid.all():
+        df = df[valid]
+    if df.dtypes.astype(str).to_dict() != BAR_DTYPES:
+        df = df.astype(BAR_DTYPES)
+    return df
+
+def write_cache(ticker, df):
+    if df.empty:
+        return  # never cache a failed download
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(df), CACHE_DIR / f"{ticker}_{PERIOD}_{INTERVAL}.parquet")
+    except Exception:
+        pass
+
+def load_bars(ticker):
+    df = read_cache(ticker)
+    if df is not None:
+        return df
+    try:
+        df = yf.download(ticker, period=PERIOD, interval=INTERVAL, progress=False)
     except Exception:
         return pd.DataFrame()
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.get_level_values(0)  # drop the ticker level
+    df = clean_bars(df)
+    write_cache(ticker, df)
+    return df
+
+def fetch_batch(tickers):
+    # One batched request for every ticker instead of one round-trip each
+    try:
+        raw = yf.download(
+            tickers, period=PERIOD, interval=INTERVAL,
+            group_by="ticker", threads=True, progress=False
+        )
+    except Exception:
+        return {}
+    if not isinstance(raw.columns, pd.MultiIndex):
+        # single ticker comes back as a flat frame
+        bars = {tickers[0]: clean_bars(raw)} if len(tickers) == 1 else {}
+    else:
+        present = set(raw.columns.get_level_values(0))
+        bars = {tkr: clean_bars(raw[tkr]) for tkr in tickers if tkr in present}
+    for tkr, df in bars.items():
+        write_cache(tkr, df)
+    return bars
+
+def fetch_all(tickers):
+    bars = {t: read_cache(t) for t in tickers}
+    stale = [t for t, df in bars.items() if df is None]
+    if stale:
+        bars.update(fetch_batch(stale))
+    # Retry anything the batch dropped concurrently; the downloads are I/O-bound
+    missing = [t for t in tickers if bars.get(t) is None or bars[t].empty]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(8, len(missing))) as ex:
+            bars.update(zip(missing, ex.map(load_bars, missing)))
+    return {t: df for t, df in bars.items() if len(df) >= 20}  # skip tickers with insufficient data
+
+def stack_bars(bars, fields=("High", "Low", "Close", "Volume"), min_rows=126):
+    # Right-align every ticker into (T, N) arrays so row -k is each ticker's
+    # k-th most recent bar; shorter histories are NaN-padded at the top
+    rows = max(min_rows, *(len(df) for df in bars.values()))
+    # Prices stay float32 to halve the bytes each sweep moves; volume is
+    # padded with NaN too, so it needs a float wide enough for its sums
+    out = {f: np.full((rows, len(bars)), np.nan, dtype=np.float64 if f == "Volume" else np.float32) for f in fields}
+    for j, df in enumerate(bars.values()):
+        for f in fields:
+            out[f][rows - len(df):, j] = df[f].to_numpy()
+    return out
+
+def screen_arrays(high, low, close, volume, min_volume, min_adr, min_gain_1m, min_gain_3m):
+    # Whole-universe kernel over (T, N) arrays: returns the surviving column
+    # indices and a (6, k) metric matrix in RESULT_COLUMNS order. Filters run
+    # cheapest first and each only sees the tickers that passed the last one,
+    # so the full-history volume/ADR sweeps touch as few columns as possible.
+    keep = np.arange(close.shape[1])
+
+    # 1/3/6-month gains in one fancy-indexed slice; short history counts as 0
+    start = close[[-21, -63, -126]]
+    gains = np.nan_to_num(((close[-1] - start) / start) * 100)
+    ok = (gains[0] >= min_gain_1m) & (gains[1] >= min_gain_3m)
+    keep, gains = keep[ok], gains[:, ok]
+
+    # Every ticker has >= 20 bars, so the latest SMAs are plain tail means
+    recent = close[-20:, keep]
+    ok = (recent[-1] > recent[-10:].mean(axis=0)) & (recent[-1] > recent.mean(axis=0))
+    keep, gains = keep[ok], gains[:, ok]
+
+    cons = consolidation_score(high[-10:, keep], low[-10:, keep], close[-10:, keep])
+    ok = cons < 0.1
+    keep, gains, cons = keep[ok], gains[:, ok], cons[ok]
+
+    avg_vol = np.nanmean(volume[:, keep], axis=0)
+    ok = avg_vol >= min_volume
+    keep, gains, cons, avg_vol = keep[ok], gains[:, ok], cons[ok], avg_vol[ok]
 
-def percent_change(df, days):
-    if len(df) < days:
-        return 0
-    start = df["Close"].iloc[-days]
-    end = df["Close"].iloc[-1]
-    return ((end - start) / start) * 100
+    avg_adr = np.nanmean(adr_percent(high[:, keep], low[:, keep], close[:, keep]), axis=0)
+    ok = avg_adr >= min_adr
+    keep, gains, cons, avg_vol, avg_adr = keep[ok], gains[:, ok], cons[ok], avg_vol[ok], avg_adr[ok]
+
+    return keep, np.vstack([gains, avg_vol, avg_adr, cons])
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def screen(bars, thresholds):
+    # Memoized on the bars' contents, so results can never outlive the data
+    # they came from and a failed or partial download is never pinned
+    a = stack_bars(bars)
+    keep, metrics = screen_arrays(a["High"], a["Low"], a["Close"], a["Volume"], *thresholds)
+    df_res = pd.DataFrame(metrics.T, columns=RESULT_COLUMNS).round(RESULT_DECIMALS)
+    df_res["Avg Volume"] = df_res["Avg Volume"].astype(np.int64)
+    df_res.insert(0, "Ticker", np.array(list(bars))[keep])
+    return df_res
+
+def run_scan(tickers, thresholds):
+    # One batched download for everything not cached on disk, then screen
+    # SCAN_CHUNK tickers at a time, yielding (tickers done, total, matches
+    # so far, their bars) after each slice so large scans show partial results
+    bars = fetch_all(list(tickers))
+    names = list(bars)
+    parts, dfs = [], {}
+    for i in range(0, len(names), SCAN_CHUNK):
+        part = screen({t: bars[t] for t in names[i:i + SCAN_CHUNK]}, thresholds)
+        if not part.empty:
+            parts.append(part)
+            dfs.update({t: bars[t] for t in part["Ticker"]})
+        yield min(i + SCAN_CHUNK, len(names)), len(names), pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(), dfs
 
 # --- Scan Button ---
+tickers = tuple(t.strip().upper() for t in tickers_input.split(",") if t.strip())
+thresholds = (min_volume, min_adr, min_gain_1m, min_gain_3m)
+
 if st.button("🔍 SCAN NOW"):
-    tickers = [t.strip().upper() for t in tickers_input.split(",") if t.strip()]
-    results = []
-
-    progress_text = "Scanning tickers..."
-    my_bar = st.progress(0, text=progress_text)
-
-    for i, tkr in enumerate(tickers):
-        df = fetch_data(tkr)
-        if df.empty:
-            continue  # skip tickers with insufficient data
-
-        avg_vol = df["Volume"].mean()
-        avg_adr = df["ADR%"].mean()
-        gain_1m = percent_change(df, 21)
-        gain_3m = percent_change(df, 63)
-        gain_6m = percent_change(df, 126)
-        cons = consolidation_score(df)
-
-        try:
-            above_sma = df["Close"].iloc[-1] > df["10SMA"].iloc[-1] and df["Close"].iloc[-1] > df["20SMA"].iloc[-1]
-        except:
-            continue  # skip if SMA calculation fails
-
-        if (
-            avg_vol >= min_volume
-            and avg_adr >= min_adr
-            and gain_1m >= min_gain_1m
-            and gain_3m >= min_gain_3m
-            and above_sma
-            and cons < 0.1
-        ):
-            results.append({
-                "Ticker": tkr,
-                "1M Gain %": round(gain_1m,1),
-                "3M Gain %": round(gain_3m,1),
-                "6M Gain %": round(gain_6m,1),
-                "Avg Volume": int(avg_vol),
-                "ADR %": round(avg_adr,2),
-                "Consolidation": round(cons,3)
-            })
-
-        # Update progress bar
-        my_bar.progress((i+1)/len(tickers), text=f"Scanning {tkr} ({i+1}/{len(tickers)})")
+    df_res, dfs = pd.DataFrame(), {}
+
+    my_bar = st.progress(0, text="Downloading tickers...")
+    placeholder = st.empty()  # matches so far, redrawn after every chunk
+
+    for done, total, df_res, dfs in run_scan(tickers, thresholds):
+        my_bar.progress(done / total, text=f"Scanning tickers ({done}/{total})")
+        if not df_res.empty:
+            placeholder.dataframe(df_res, use_container_width=True)
 
     my_bar.empty()  # remove progress bar
+    placeholder.empty()
+    if not df_res.empty:
+        df_res = df_res.sort_values("3M Gain %", ascending=False)
+    # Keep the results and matched frames across reruns so picking a chart
+    # neither hides the table nor re-scans or re-downloads anything
+    st.session_state["scan"] = df_res
+    st.session_state["dfs"] = dfs
+    st.session_state["scan_key"] = (tickers, thresholds)
 
-    if results:
-        df_res = pd.DataFrame(results).sort_values("3M Gain %", ascending=False)
+# --- Results ---
+if "scan" in st.session_state:
+    df_res = st.session_state["scan"]
+    if st.session_state["scan_key"] != (tickers, thresholds):
+        st.info("ℹ️ Showing results from the previous scan; press SCAN NOW to apply the current tickers and filters.")
+
+    if not df_res.empty:
         st.success(f"✅ Found {len(df_res)} stocks matching filters")
         st.dataframe(df_res, use_container_width=True)
 
         sel = st.selectbox("📊 Select a Ticker to View Chart", df_res["Ticker"])
-        dfc = fetch_data(sel)
+        dfc = add_indicators(st.session_state["dfs"][sel])  # only the charted ticker needs SMA series
 
+        # Hand Plotly plain ndarrays so it serializes homogeneous buffers, not Series
+        x = dfc.index.to_numpy()
+        o, h, l, c, sma10, sma20 = (
+            dfc[k].to_numpy(dtype="float32") for k in ("Open", "High", "Low", "Close", "10SMA", "20SMA")
+        )
         fig = go.Figure(
             data=[
-                go.Candlestick(
-                    x=dfc.index, open=dfc["Open"], high=dfc["High"], low=dfc["Low"], close=dfc["Close"], name="Price"
-                ),
-                go.Scatter(x=dfc.index, y=dfc["10SMA"], line=dict(color="orange"), name="10 SMA"),
-                go.Scatter(x=dfc.index, y=dfc["20SMA"], line=dict(color="blue"), name="20 SMA"),
+                go.Candlestick(x=x, open=o, high=h, low=l, close=c, name="Price"),
+                go.Scatter(x=x, y=sma10, line=dict(color="orange"), name="10 SMA"),
+                go.Scatter(x=x, y=sma20, line=dict(color="blue"), name="20 SMA"),
             ]
         )
         fig.update_layout(title=f"{sel} – Daily Chart", xaxis_rangeslider_visible=False)